@@ -1,9 +1,19 @@
 # ai_filter.py
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 import os
 import logging
 import time
-from db_manager import get_articles_for_ai_check, update_ai_check_result
+import json
+import random
+import hashlib
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from collections import OrderedDict
+from db_manager import iter_articles_for_ai_check, update_ai_check_results, get_cached_classifications
 from dotenv import load_dotenv # Import dotenv here too
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -26,131 +36,336 @@ else:
 
 
 # Define the prompt for classification
+# Several articles are packed into one request so that we are limited by tokens per minute
+# rather than requests per minute.
 AI_CHECK_PROMPT_TEMPLATE = """
-Analyze the following article title and summary.
-Is the article primarily about Artificial Intelligence (AI), machine learning, large language models, generative AI, neural networks, or closely related AI subfields?
+Analyze each of the following numbered articles (title and summary).
+For each one, decide whether the article is primarily about Artificial Intelligence (AI), machine learning, large language models, generative AI, neural networks, or closely related AI subfields.
 
-Title: "{title}"
-Summary: "{summary}"
+{articles}
 
-Answer ONLY with "Yes" or "No".
+Answer ONLY with a JSON list like ["Yes", "No", ...] containing exactly {count} answers, one per article, in the same order.
 """
 
+ARTICLE_PROMPT_TEMPLATE = '{index}. Title: "{title}"\n   Summary: "{summary}"'
+
+# Use the safety_settings argument to reduce refusals for simple Yes/No
+SAFETY_SETTINGS = (
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
+)
+
+YES_RESPONSES = frozenset({"yes"})
+NO_RESPONSES = frozenset({"no"})
+
+AI_CHECK_BATCH_SIZE = 20 # Articles classified per Gemini request
+MAX_CONCURRENCY = 16 # Gemini requests in flight at the same time
+RATE_LIMIT_RPM = 60 # Requests per minute allowed by the Gemini free tier
+RATE_LIMIT_TPM = 1_000_000 # Tokens per minute allowed by the Gemini free tier
+CLASSIFICATION_CACHE_SIZE = 10000 # Content hashes remembered in memory between runs
+REQUEST_TIMEOUT = 15 # seconds before a stalled Gemini request is abandoned
 MAX_RETRIES = 3
-RETRY_DELAY = 5 # seconds
+RETRY_BASE_DELAY = 1 # seconds, doubled on every retry
+MAX_RETRY_DELAY = 60 # seconds
+
+# Rate limiting and transient server-side failures are worth retrying; anything else (bad request,
+# invalid API key, ...) will fail the same way again.
+RETRYABLE_EXCEPTIONS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+)
+
+# Returned by is_articles_ai_related when a batch's answer was blocked or unreadable, so that
+# _check_articles re-queues its articles one at a time
+SPLIT_BATCH = object()
+
+class RateLimiter:
+    """
+    Proactive token-bucket limiter for both requests per minute and tokens per minute.
+
+    Both buckets refill continuously, so requests only wait when a bucket is actually empty
+    instead of sleeping a fixed amount after every call.
+    """
+
+    def __init__(self, rpm, tpm):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.available_request_capacity = float(rpm)
+        self.available_token_capacity = float(tpm)
+        self.last_update_time = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.last_update_time
+        self.available_request_capacity = min(self.rpm, self.available_request_capacity + elapsed * self.rpm / 60)
+        self.available_token_capacity = min(self.tpm, self.available_token_capacity + elapsed * self.tpm / 60)
+        self.last_update_time = now
+
+    async def acquire(self, tokens):
+        """Waits until one request and `tokens` tokens are available, then consumes them."""
+        tokens = min(tokens, self.tpm) # A single request can never need more than a full bucket
+        while True:
+            self._refill()
+            if self.available_request_capacity >= 1 and self.available_token_capacity >= tokens:
+                self.available_request_capacity -= 1
+                self.available_token_capacity -= tokens
+                return
+            request_wait = (1 - self.available_request_capacity) * 60 / self.rpm
+            token_wait = (tokens - self.available_token_capacity) * 60 / self.tpm
+            await asyncio.sleep(max(request_wait, token_wait, 0))
+
+rate_limiter = RateLimiter(rpm=RATE_LIMIT_RPM, tpm=RATE_LIMIT_TPM)
+
+# Worker threads for SDK versions without generate_content_async; the blocking call releases the GIL during network I/O
+_gemini_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY, thread_name_prefix="gemini")
+
+# The SDK caches its async gRPC client (and its channel) against the event loop it was first used on,
+# so every AI check run goes through the same loop to keep reusing that connection.
+_event_loop = None
+_event_loop_lock = threading.Lock()
+
+def _run_async(coro):
+    """Runs a coroutine on the module's long-lived event loop."""
+    global _event_loop
+    with _event_loop_lock: # Streamlit sessions run in separate threads
+        if _event_loop is None or _event_loop.is_closed():
+            _event_loop = asyncio.new_event_loop()
+        return _event_loop.run_until_complete(coro)
 
-def is_article_ai_related(title, summary):
-    # ... (function remains the same, relies on the globally configured 'model') ...
+# In-process LRU layer in front of the classification_cache table
+_classification_memo = OrderedDict()
+
+def content_hash(article):
+    """Returns a stable hash of an article's title and summary, used to reuse earlier classifications."""
+    content = (article.get('title') or '') + "\n" + (article.get('summary') or '')
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+def _remember_classification(article_hash, is_ai):
+    _classification_memo[article_hash] = is_ai
+    _classification_memo.move_to_end(article_hash)
+    if len(_classification_memo) > CLASSIFICATION_CACHE_SIZE:
+        _classification_memo.popitem(last=False) # Drop the least recently used entry
+
+def _lookup_classifications(article_hashes):
+    """Returns {hash: is_ai} for every hash classified before, checking memory first and then the DB."""
+    found = {}
+    missing = set()
+    for article_hash in set(article_hashes):
+        if article_hash in _classification_memo:
+            _classification_memo.move_to_end(article_hash)
+            found[article_hash] = _classification_memo[article_hash]
+        else:
+            missing.add(article_hash)
+
+    for article_hash, is_ai in get_cached_classifications(missing).items():
+        _remember_classification(article_hash, is_ai)
+        found[article_hash] = is_ai
+    return found
+
+def _batched(items, size):
+    """Yields successive lists of at most `size` items."""
+    items_iter = iter(items)
+    while True:
+        batch = list(islice(items_iter, size))
+        if not batch:
+            return
+        yield batch
+
+async def _generate_content(prompt, **kwargs):
+    """Calls Gemini without blocking the event loop, using a worker thread if the SDK has no async client."""
+    if hasattr(model, 'generate_content_async'):
+        return await model.generate_content_async(prompt, **kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_gemini_executor, partial(model.generate_content, prompt, **kwargs))
+
+async def is_articles_ai_related(batch):
+    """
+    Classifies a batch of articles with a single Gemini request.
+
+    Args:
+        batch: List of article dictionaries with a non-empty 'title' and an optional 'summary'
+
+    Returns:
+        A list of booleans in the same order as the batch, None if the check could not be performed, or
+        SPLIT_BATCH if a batch of several articles got a blocked or unreadable answer.
+    """
     if not model:
         logging.error("Gemini AI model is not available (was not configured).")
         return None # Indicate AI check couldn't be performed
 
-    if not title:
-        logging.warning("Cannot check article without a title.")
-        return None
+    if not batch:
+        return []
 
-    prompt = AI_CHECK_PROMPT_TEMPLATE.format(
-        title=title,
-        summary=summary if summary else "No summary available." # Handle missing summary
+    articles_text = "\n".join(
+        ARTICLE_PROMPT_TEMPLATE.format(
+            index=i + 1,
+            title=article['title'], # Untitled articles are filtered out before batching
+            summary=article.get('summary') or "No summary available." # Handle missing summary
+        )
+        for i, article in enumerate(batch)
     )
+    prompt = AI_CHECK_PROMPT_TEMPLATE.format(articles=articles_text, count=len(batch))
+    # Keep the output bounded and deterministic: the answer is only a short JSON list
+    generation_config = genai.types.GenerationConfig(
+        response_mime_type="application/json",
+        max_output_tokens=4 * len(batch), # '"Yes", ' is a handful of tokens per article
+        temperature=0.0,
+        candidate_count=1,
+    )
+    estimated_tokens = len(prompt) // 4 + generation_config.max_output_tokens # ~4 characters per token
+
+    # Only API errors are retried: the request is deterministic, so a blocked or unreadable answer would repeat
+    for attempt in range(1, MAX_RETRIES + 1):
+        try:
+            await rate_limiter.acquire(estimated_tokens)
+            response = await _generate_content(
+                prompt,
+                safety_settings=SAFETY_SETTINGS,
+                generation_config=generation_config,
+                request_options={"timeout": REQUEST_TIMEOUT},
+            )
+            break
+        except RETRYABLE_EXCEPTIONS as e:
+            logging.warning(f"Transient Gemini API error for a batch of {len(batch)} articles (Attempt {attempt}/{MAX_RETRIES}): {e}")
+            if attempt == MAX_RETRIES:
+                logging.error(f"Max retries reached for a batch of {len(batch)} articles. AI check failed.")
+                return None # Indicate failure after retries
+            # Exponential backoff with jitter so concurrent batches don't retry in lockstep
+            delay = min(MAX_RETRY_DELAY, RETRY_BASE_DELAY * 2 ** attempt) * random.uniform(0.5, 1.5)
+            logging.info(f"Retrying in {delay:.1f} seconds...")
+            await asyncio.sleep(delay)
+        except Exception as e:
+            logging.error(f"Error calling Gemini API for a batch of {len(batch)} articles: {e}. Not retrying.")
+            return None
 
-    retries = 0
-    while retries < MAX_RETRIES:
+    # Check if the response was blocked despite settings
+    if not response.parts:
+        logging.warning(f"Gemini response blocked for a batch of {len(batch)} articles. Treating as indeterminate.")
+    else:
         try:
-            # Use the safety_settings argument to reduce refusals for simple Yes/No
-            safety_settings = [
-                {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
-            ]
-            response = model.generate_content(prompt, safety_settings=safety_settings)
-
-            # Check if the response was blocked despite settings
-            if not response.parts:
-                 logging.warning(f"Gemini response blocked for '{title}'. Prompt: {prompt}. Treating as indeterminate.")
-                 # You might decide to treat blocked responses differently, e.g., always False or None
-                 if retries == MAX_RETRIES - 1:
-                     return False # Assume 'No' after final retry if blocked
-                 # Fall through to retry logic
-
-            else:
-                # Clean up the response text
-                cleaned_response = response.text.strip().lower().replace('.', '') # Remove periods too
-
-                if cleaned_response == 'yes':
-                    logging.debug(f"AI classified '{title}' as AI-related.")
-                    return True
-                elif cleaned_response == 'no':
-                    logging.debug(f"AI classified '{title}' as NOT AI-related.")
-                    return False
-                else:
-                    logging.warning(f"Unexpected AI response for '{title}': '{response.text}'. Treating as indeterminate.")
-                    if retries == MAX_RETRIES - 1:
-                        return False # Assume 'No' after final retry fails to get clear answer
+            answers = json.loads(response.text)
+        except ValueError:
+            answers = None
 
+        if isinstance(answers, list) and len(answers) == len(batch):
+            results = []
+            for article, answer in zip(batch, answers):
+                cleaned_answer = str(answer).strip().lower()
+                is_ai = cleaned_answer in YES_RESPONSES
+                if not is_ai and cleaned_answer not in NO_RESPONSES:
+                    logging.warning(f"Unexpected AI answer for '{article.get('title')}': '{answer}'. Treating as 'No'.")
+                logging.debug(f"AI classified '{article.get('title')}' as {'AI-related' if is_ai else 'NOT AI-related'}.")
+                results.append(is_ai)
+            return results
 
-        except Exception as e:
-            logging.error(f"Error calling Gemini API for article '{title}' (Attempt {retries+1}/{MAX_RETRIES}): {e}")
-            if "rate limit" in str(e).lower():
-                logging.warning("Rate limit likely hit. Waiting before retry...")
+        logging.warning(f"Unexpected AI response for a batch of {len(batch)} articles: '{response.text}'. Treating as indeterminate.")
+
+    if len(batch) == 1:
+        return [False] # Assume 'No', so the article isn't re-sent on every run
+    # One problem article shouldn't hold back the rest of its batch
+    return SPLIT_BATCH
+
+
+async def _check_articles(articles_to_check):
+    """Classifies articles concurrently, one batch per request, and stores the results as batches complete."""
+    processed_count = 0
+    ai_related_count = 0
+
+    # Identical title/summary pairs (e.g. republished articles) reuse an earlier answer instead of calling the API
+    article_hashes = {article['url']: content_hash(article) for article in articles_to_check}
+    known = _lookup_classifications(article_hashes.values())
+    if known:
+        cached_results = [
+            (article['url'], known[article_hashes[article['url']]])
+            for article in articles_to_check if article_hashes[article['url']] in known
+        ]
+        processed_count += update_ai_check_results(cached_results)
+        ai_related_count += sum(1 for _, is_ai in cached_results if is_ai)
+        logging.info(f"Reused cached classifications for {len(cached_results)} articles.")
+        articles_to_check = [article for article in articles_to_check if article_hashes[article['url']] not in known]
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+
+    async def check_batch(batch):
+        async with semaphore:
+            logging.debug(f"Checking batch of {len(batch)} articles (URLs {[a['url'] for a in batch]})")
+            return batch, await is_articles_ai_related(batch)
 
-            retries += 1
-            if retries < MAX_RETRIES:
-                 logging.info(f"Retrying in {RETRY_DELAY} seconds...")
-                 time.sleep(RETRY_DELAY)
-            else:
-                 logging.error(f"Max retries reached for article '{title}'. AI check failed.")
-                 return None # Indicate failure after retries
+    pending = {asyncio.create_task(check_batch(batch)) for batch in _batched(articles_to_check, AI_CHECK_BATCH_SIZE)}
 
-    return None
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            batch, results = task.result()
+
+            if results is SPLIT_BATCH:
+                # Re-queue behind the same semaphore, so the single-article requests stay within MAX_CONCURRENCY
+                logging.info(f"Checking the {len(batch)} articles of the indeterminate batch one at a time.")
+                pending.update(asyncio.create_task(check_batch([article])) for article in batch)
+                continue
+
+            if results is None: # Only update if AI check succeeded (returned a list of True/False)
+                logging.warning(f"AI check failed for article URLs {[a['url'] for a in batch]}. They will be retried later.")
+                continue
+
+            batch_results = [(article['url'], is_ai) for article, is_ai in zip(batch, results)]
+            cache_entries = [(article_hashes[article['url']], is_ai) for article, is_ai in zip(batch, results)]
+            updated = update_ai_check_results(batch_results, cache_entries)
+            for article_hash, is_ai in cache_entries:
+                _remember_classification(article_hash, is_ai)
+            if updated < len(batch_results):
+                logging.warning(f"Only {updated} of {len(batch_results)} AI check results were stored in the DB for this batch")
+            processed_count += updated
+            ai_related_count += sum(1 for _, is_ai in batch_results if is_ai)
+
+    return processed_count, ai_related_count
+
+
+def _ensure_model():
+    """
+    Returns the Gemini model, configuring it on first use if the module-level configuration didn't happen
+    (e.g. the .env file wasn't loaded yet when this module was imported).
+    """
+    global model
+    if model is not None:
+        return model
+
+    load_dotenv() # Load .env specifically for this function if run standalone
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if not api_key:
+        logging.error("Cannot process articles: GEMINI_API_KEY not found.")
+        raise EnvironmentError("GEMINI_API_KEY not found. Cannot run AI check.") # Raise error
+
+    try:
+        genai.configure(api_key=api_key)
+        model = genai.GenerativeModel('gemini-1.5-flash-latest')
+        logging.info("Gemini AI model configured successfully on first use.")
+    except Exception as e:
+        logging.error(f"Error configuring Gemini AI on first use: {e}")
+        model = None # Ensure it's None if config fails
+    return model
 
 
 def process_articles_for_ai_theme():
     """Fetches unchecked articles from DB and updates them with AI classification."""
-    global model # Make sure we're using the potentially configured model
-    if not model: # Double check if model was configured
-         # Try to configure again, maybe .env loaded later?
-         load_dotenv() # Load .env specifically for this function if run standalone
-         api_key = os.environ.get("GEMINI_API_KEY")
-         if api_key:
-              try:
-                   genai.configure(api_key=api_key)
-                   model = genai.GenerativeModel('gemini-1.5-flash-latest')
-                   logging.info("Gemini AI model configured successfully within process function.")
-              except Exception as e:
-                   logging.error(f"Error configuring Gemini AI within process function: {e}")
-                   model = None # Ensure it's None if config fails
-         else:
-              logging.error("Cannot process articles: GEMINI_API_KEY not found.")
-              raise EnvironmentError("GEMINI_API_KEY not found. Cannot run AI check.") # Raise error
+    _ensure_model()
 
     logging.info("Starting AI theme check process...")
-    articles_to_check = get_articles_for_ai_check()
-    logging.info(f"Found {len(articles_to_check)} articles needing AI check.")
-
-    processed_count = 0
-    ai_related_count = 0
+    found_count = 0
+    articles_to_check = []
+    for article in iter_articles_for_ai_check():
+        found_count += 1
+        # Articles without a title can't be classified, so don't spend API budget on them
+        if article.get('title'):
+            articles_to_check.append(article)
+    logging.info(f"Found {found_count} articles needing AI check.")
+    logging.info(f"{len(articles_to_check)} articles left after filtering out untitled ones.")
 
-    for article in articles_to_check:
-        article_id = article['id']
-        title = article['title']
-        summary = article.get('summary', '') # Use empty string if summary is None
-
-        logging.debug(f"Checking article ID {article_id}: '{title}'")
-        is_ai = is_article_ai_related(title, summary)
-
-        if is_ai is not None: # Only update if AI check succeeded (returned True or False)
-            if update_ai_check_result(article_id, is_ai):
-                 processed_count += 1
-                 if is_ai:
-                    ai_related_count += 1
-                 # Add a small delay to respect potential free tier rate limits
-                 time.sleep(1.1) # Slightly more than 1 sec for ~60 RPM limit
-            else:
-                 logging.warning(f"Failed to update AI check status in DB for article ID {article_id}")
-        else:
-            logging.warning(f"AI check failed for article ID {article_id}. It will be retried later.")
+    processed_count, ai_related_count = _run_async(_check_articles(articles_to_check))
 
     logging.info(f"AI theme check process completed. Processed: {processed_count}, Identified as AI-related: {ai_related_count}")
     return processed_count, ai_related_count
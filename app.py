@@ -5,20 +5,22 @@ from datetime import datetime, timedelta, date
 import time
 import logging
 import os
+import io
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
 # Import functions from other modules AFTER loading .env
-from db_manager import init_db, store_articles, get_ai_articles
-from scraper import fetch_articles, filter_articles_by_date
+from db_manager import init_db, store_new_articles, get_ai_articles, count_ai_articles
+from scraper import fetch_articles, fetch_all_sections, filter_articles_by_date
 from ai_filter import process_articles_for_ai_theme
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # --- Configuration ---
 PDF_FILENAME = "ai_news_report.pdf"
+ARTICLES_PER_PAGE = 50
 APP_TITLE = "AI News Article Extractor (BBC News)"
 
 # Available BBC news sections for the dropdown
@@ -31,24 +33,38 @@ BBC_SECTIONS = {
 }
 
 # --- PDF Generation ---
+# Unicode font files by style. Assumes .ttf files are in the same directory as app.py or accessible in system paths.
+DEJAVU_FONT_FILES = {"": "DejaVuSans.ttf", "B": "DejaVuSans-Bold.ttf", "I": "DejaVuSans-Italic.ttf"}
+
 class PDF(FPDF):
+    # Whether the DejaVu fonts could be loaded, remembered across instances so that later exports
+    # don't repeat a font lookup (and warning) that already failed once in this process
+    _dejavu_available = None
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.font_loaded = False # Flag to track if DejaVu font loaded
-        try:
-            # Try to add the Unicode font.
-            # Assumes .ttf files are in the same directory as app.py or accessible in system paths.
-            # If these files are not present, the except block will handle it.
-            self.add_font("DejaVu", "", "DejaVuSans.ttf", uni=True)
-            self.add_font("DejaVu", "B", "DejaVuSans-Bold.ttf", uni=True)
-            self.add_font("DejaVu", "I", "DejaVuSans-Italic.ttf", uni=True)
-            self.set_fallback_fonts(['DejaVu']) # Use DejaVu if character not in current font
-            self.font_loaded = True # Set flag only if loading succeeds
-            logging.info("DejaVu font loaded successfully. Using for PDF.")
-        except (FileNotFoundError, RuntimeError) as e:
-            # This block executes if the font files aren't found or FPDF has trouble
-            logging.warning(f"DejaVu font not found or failed to load ({e}). Falling back to default fonts (may not support all characters).")
-            # self.font_loaded remains False
+        if PDF._dejavu_available is False:
+            logging.debug("DejaVu font unavailable (checked earlier). Using default fonts.")
+        else:
+            try:
+                # Try to add the Unicode font.
+                # If these files are not present, the except block will handle it.
+                for style, font_file in DEJAVU_FONT_FILES.items():
+                    self.add_font("DejaVu", style, font_file)
+                self.set_fallback_fonts(['DejaVu']) # Use DejaVu if character not in current font
+                self.font_loaded = True # Set flag only if loading succeeds
+                if PDF._dejavu_available is None:
+                    logging.info("DejaVu font loaded successfully. Using for PDF.")
+                PDF._dejavu_available = True
+            except (FileNotFoundError, RuntimeError) as e:
+                # This block executes if the font files aren't found or FPDF has trouble
+                logging.warning(f"DejaVu font not found or failed to load ({e}). Falling back to default fonts (may not support all characters).")
+                PDF._dejavu_available = False
+                # self.font_loaded remains False
+
+        # Pick the text preparation once: Unicode fonts take text as is, default fonts need the latin-1 round-trip
+        self._prepare_text = str if self.font_loaded else self._prepare_text_latin1
 
     def _set_font_style(self, style='', size=10):
         """Helper to set font based on whether DejaVu loaded"""
@@ -60,18 +76,13 @@ class PDF(FPDF):
             logging.error(f"Could not set font {family} {style} {size}. Trying Arial.")
             self.set_font('Arial', style, size) # Default safe fallback
 
-    def _prepare_text(self, text_input):
-        """Helper to encode text ONLY if using default (non-Unicode) fonts"""
-        if self.font_loaded:
-            # If DejaVu (Unicode) font is loaded, return text as is
-            return str(text_input) # Ensure it's a string
-        else:
-            # If using default fonts (Arial), apply encoding safety for non-Latin-1 chars
-            try:
-                return str(text_input).encode('latin-1', 'replace').decode('latin-1')
-            except Exception as e:
-                logging.error(f"Error encoding text '{str(text_input)[:20]}...' for PDF: {e}")
-                return "[Encoding Error]" # Placeholder for errors
+    def _prepare_text_latin1(self, text_input):
+        """Helper to encode text for default (non-Unicode) fonts, which only support Latin-1"""
+        try:
+            return str(text_input).encode('latin-1', 'replace').decode('latin-1')
+        except Exception as e:
+            logging.error(f"Error encoding text '{str(text_input)[:20]}...' for PDF: {e}")
+            return "[Encoding Error]" # Placeholder for errors
 
     def header(self):
         self._set_font_style('B', 12)
@@ -109,35 +120,49 @@ def generate_pdf(selected_articles):
     for article in selected_articles:
         pdf.chapter_title(article.get('title', 'No Title'))
 
-        pdf._set_font_style('I', 9) # Use helper for metadata font
-
-        # Use helper to prepare text for metadata, applying encoding if needed
-        url_text = pdf._prepare_text(f"URL: {article.get('url', 'N/A')}")
-        pdf.cell(0, 5, url_text, ln=1)
-        date_text = pdf._prepare_text(f"Date: {article.get('publication_date', 'N/A')}")
-        pdf.cell(0, 5, date_text, ln=1)
-        source_text = pdf._prepare_text(f"Source: {article.get('source', 'N/A')}")
-        pdf.cell(0, 5, source_text, ln=1)
-        pdf.ln(3)
-
+        # Metadata and summary go out in one block so the layout is computed once per article
+        body = (
+            f"URL: {article.get('url', 'N/A')}\n"
+            f"Date: {article.get('publication_date', 'N/A')}\n"
+            f"Source: {article.get('source', 'N/A')}\n"
+            f"\n"
+            f"Summary:\n"
+            f"{article.get('summary') or 'No summary available.'}"
+        )
         # chapter_body calls _prepare_text internally
-        pdf.chapter_body("Summary:")
-        pdf.chapter_body(article.get('summary', 'No summary available.'))
+        pdf.chapter_body(body)
         pdf.ln(10) # Add space between articles
 
     # Output PDF as bytes
     try:
-        # Fix: Ensure we're returning bytes, not bytearray
-        pdf_output = pdf.output(dest='S')
-        # Convert to bytes if it's not already
-        if isinstance(pdf_output, bytearray):
-            pdf_output = bytes(pdf_output)
-        return pdf_output
+        # Write straight into a buffer (fpdf2 accepts file-like objects) instead of copying the bytearray
+        buffer = io.BytesIO()
+        pdf.output(buffer)
+        return buffer.getvalue()
     except Exception as e:
          logging.error(f"Error generating PDF output: {e}", exc_info=True)
          st.error(f"Failed to generate PDF: {e}")
          return None
 
+# --- Cached DB access ---
+# Every widget interaction reruns the whole script, so keep DB work out of the rerun path.
+@st.cache_resource
+def _init_database():
+    init_db()
+
+@st.cache_data(ttl=60)
+def _load_ai_articles(display_date, limit, offset):
+    return get_ai_articles(target_date=display_date, limit=limit, offset=offset)
+
+@st.cache_data(ttl=60)
+def _count_ai_articles(display_date):
+    return count_ai_articles(target_date=display_date)
+
+def _clear_article_caches():
+    """Invalidates cached article queries after the database has changed."""
+    _load_ai_articles.clear()
+    _count_ai_articles.clear()
+
 # --- Streamlit App ---
 def run_streamlit_app():
     st.set_page_config(page_title=APP_TITLE, layout="wide")
@@ -146,7 +171,7 @@ def run_streamlit_app():
 
     # Initialize Database
     try:
-        init_db()
+        _init_database()
     except Exception as e:
         st.error(f"Fatal Error: Could not initialize database. Check logs. Error: {e}")
         st.stop()
@@ -176,8 +201,9 @@ def run_streamlit_app():
                 if raw_articles is not None:
                     articles_for_date = filter_articles_by_date(raw_articles, target_date)
                     if articles_for_date:
-                        # Pass the update_existing parameter to store_articles
-                        count = store_articles(articles_for_date, update_existing)
+                        # Articles already in the database are filtered out in memory unless they should be updated
+                        count = store_new_articles(articles_for_date, update_existing)
+                        _clear_article_caches()
                         st.sidebar.success(f"Fetched {len(articles_for_date)} articles for {target_date}. Added or updated {count} articles.")
                     else:
                         st.sidebar.warning(f"No articles found on {selected_source} for {target_date}.")
@@ -187,6 +213,22 @@ def run_streamlit_app():
                  st.sidebar.error(f"Error during fetch/store: {e}")
                  logging.error(f"Error during fetch/store: {e}", exc_info=True)
 
+    if st.sidebar.button("Fetch All Sections for Selected Date"):
+        with st.spinner(f"Fetching articles from all {len(BBC_SECTIONS)} sections for {target_date}..."):
+            try:
+                raw_articles = fetch_all_sections(BBC_SECTIONS)
+                articles_for_date = filter_articles_by_date(raw_articles, target_date)
+                if articles_for_date:
+                    # Store everything in one call rather than once per section
+                    count = store_new_articles(articles_for_date, update_existing)
+                    _clear_article_caches()
+                    st.sidebar.success(f"Fetched {len(articles_for_date)} articles for {target_date}. Added or updated {count} articles.")
+                else:
+                    st.sidebar.warning(f"No articles found in any section for {target_date}.")
+            except Exception as e:
+                 st.sidebar.error(f"Error during fetch/store: {e}")
+                 logging.error(f"Error during fetch/store: {e}", exc_info=True)
+
     api_key_present = bool(os.environ.get("GEMINI_API_KEY"))
 
     if st.sidebar.button("2. Run AI Check on Unprocessed Articles", disabled=not api_key_present):
@@ -196,6 +238,7 @@ def run_streamlit_app():
             with st.spinner("Running AI theme check on articles in database... This may take time."):
                 try:
                     processed, identified = process_articles_for_ai_theme()
+                    _clear_article_caches()
                     st.sidebar.success(f"AI Check Complete. Processed: {processed}, Identified as AI: {identified}")
                     try:
                         st.rerun()
@@ -212,11 +255,19 @@ def run_streamlit_app():
     st.sidebar.header("Display AI Articles")
     display_date = st.sidebar.date_input("Show AI articles published on:", target_date)
 
+    try:
+        total_ai_articles = _count_ai_articles(display_date)
+    except Exception as e:
+        st.error(f"Error counting articles in database: {e}")
+        total_ai_articles = 0
+    page_count = max(1, -(-total_ai_articles // ARTICLES_PER_PAGE)) # Ceiling division
+    page = st.sidebar.number_input("Page", min_value=1, max_value=page_count, value=1, step=1)
+
     # --- Main Area: Display AI Articles ---
     st.header(f"AI-Related Articles for {display_date}")
 
     try:
-        ai_articles = get_ai_articles(target_date=display_date)
+        ai_articles = _load_ai_articles(display_date, ARTICLES_PER_PAGE, (page - 1) * ARTICLES_PER_PAGE)
     except Exception as e:
         st.error(f"Error fetching articles from database: {e}")
         ai_articles = []
@@ -224,42 +275,25 @@ def run_streamlit_app():
     if not ai_articles:
         st.info(f"No AI-related articles found in the database for {display_date}. Try fetching/checking first.")
     else:
-        st.write(f"Found {len(ai_articles)} AI-related articles for {display_date}.")
+        st.write(f"Found {total_ai_articles} AI-related articles for {display_date}. Showing page {page} of {page_count}.")
 
-        # Use session state for checkboxes
-        if 'selected_articles' not in st.session_state:
-             # Initialize state based on currently displayed articles if state is empty
-             st.session_state.selected_articles = {article['id']: True for article in ai_articles}
-        else:
-             # Update state: Keep existing selections for displayed items, add new ones, remove old ones
-             current_ids = {article['id'] for article in ai_articles}
-             # Remove IDs not currently displayed
-             st.session_state.selected_articles = {
-                 id: selected for id, selected in st.session_state.selected_articles.items() if id in current_ids
-             }
-             # Add any new articles (default to True) that weren't in the state before
-             for article in ai_articles:
-                 if article['id'] not in st.session_state.selected_articles:
-                     st.session_state.selected_articles[article['id']] = True
-
-        articles_to_export = []
-
-        for idx, article in enumerate(ai_articles):
-            article_id = article['id']
-            checkbox_key = f"select_{article_id}_{display_date}"
-
-            # Define the callback function correctly
-            def toggle_selection(art_id):
-                current_val = st.session_state.selected_articles.get(art_id, True)
-                st.session_state.selected_articles[art_id] = not current_val
+        # Every article starts out selected, so only deselections are remembered. Streamlit drops the state of
+        # checkboxes that aren't rendered, so this set is what keeps choices made on other pages.
+        deselected_key = f"deselected_{display_date}"
+        if deselected_key not in st.session_state:
+            st.session_state[deselected_key] = set()
+        deselected_urls = st.session_state[deselected_key]
 
+        for idx, article in enumerate(ai_articles, start=(page - 1) * ARTICLES_PER_PAGE):
             is_selected = st.checkbox(
                 f"Select Article {idx+1}",
-                value=st.session_state.selected_articles.get(article_id, True),
-                key=checkbox_key,
-                on_change=toggle_selection, # Pass the function itself
-                args=(article_id,) # Pass the article_id to the callback
+                value=article['url'] not in deselected_urls,
+                key=f"select_{article['url']}_{display_date}",
             )
+            if is_selected:
+                deselected_urls.discard(article['url'])
+            else:
+                deselected_urls.add(article['url'])
 
             st.subheader(article['title'])
             st.markdown(f"**URL:** [{article['url']}]({article['url']})")
@@ -269,18 +303,19 @@ def run_streamlit_app():
                 st.write(article.get('summary', 'No summary available.'))
             st.markdown("---")
 
-            # Check the session state *after* the checkbox is drawn and potentially changed
-            if st.session_state.selected_articles.get(article_id, False): # Check the current state
-                articles_to_export.append(article)
-
 
         # --- PDF Generation Button ---
-        if articles_to_export:
+        # The selection spans every page, not just the one on screen
+        if len(deselected_urls) < total_ai_articles:
              st.markdown("---")
              st.subheader("Export Selected Articles")
 
              if st.button("Generate PDF from Selection"):
                  with st.spinner("Generating PDF..."):
+                     articles_to_export = [
+                         article for article in _load_ai_articles(display_date, None, 0)
+                         if article['url'] not in deselected_urls
+                     ]
                      pdf_data = generate_pdf(articles_to_export)
                      if pdf_data:
                          st.download_button(
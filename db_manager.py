@@ -1,40 +1,219 @@
 # db_manager.py
 import sqlite3
 import logging
+import threading
+import queue
+from contextlib import contextmanager
 from datetime import date
+from functools import lru_cache
+from pathlib import Path
+from dateutil.parser import parse
 
 DATABASE_NAME = 'news_articles.db'
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Per-connection settings. WAL mode itself is persistent in the database file and is set once in init_db().
+CONNECTION_PRAGMAS = (
+    'PRAGMA synchronous=NORMAL', # Safe in WAL mode and avoids an fsync per commit
+    'PRAGMA busy_timeout=5000', # Wait up to 5s for a lock instead of failing immediately
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-20000', # ~20 MB page cache
+    'PRAGMA mmap_size=268435456', # Memory-map up to 256 MB of the database file
+)
+
+# Connections are opened once and reused by the whole process (Streamlit reruns, the AI check, ...).
+# SQLite in WAL mode allows a single writer alongside many readers, so there is one writer
+# connection guarded by a lock plus a small pool of read-only connections.
+READ_POOL_SIZE = 4
+_writer_conn = None
+_writer_lock = threading.RLock()
+_read_pool = None
+_read_pool_lock = threading.Lock()
+# Every connection is long-lived, so a larger prepared statement cache keeps each query below parsed once
+STATEMENT_CACHE_SIZE = 256
+
+def _connect(read_only=False):
+    """Opens a connection with the tuned PRAGMAs applied."""
+    if read_only:
+        database_uri = Path(DATABASE_NAME).resolve().as_uri() + '?mode=ro'
+        conn = sqlite3.connect(database_uri, uri=True, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+    else:
+        conn = sqlite3.connect(DATABASE_NAME, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+@contextmanager
+def _write_conn():
+    """
+    Borrows the writer connection for one unit of work.
+    Writes are serialised across threads and committed (or rolled back on error) like `with conn:`.
+    """
+    global _writer_conn
+    with _writer_lock:
+        if _writer_conn is None:
+            _writer_conn = _connect()
+        with _writer_conn:
+            yield _writer_conn
+
+@contextmanager
+def _read_conn():
+    """Borrows a read-only connection from the pool, waiting if all of them are in use."""
+    global _read_pool
+    with _read_pool_lock:
+        if _read_pool is None:
+            connections = [_connect(read_only=True) for _ in range(READ_POOL_SIZE)]
+            _read_pool = queue.Queue()
+            for conn in connections:
+                _read_pool.put(conn)
+
+    conn = _read_pool.get()
+    try:
+        yield conn
+    finally:
+        _read_pool.put(conn)
+
+ARTICLES_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS articles (
+        url TEXT PRIMARY KEY, -- The natural key: every dedup check is by URL
+        title TEXT NOT NULL,
+        publication_date DATE NOT NULL,
+        summary TEXT,
+        source TEXT NOT NULL,
+        added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        is_ai_related BOOLEAN DEFAULT NULL, -- Store AI check result
+        ai_checked_at TIMESTAMP DEFAULT NULL -- When AI check was performed
+    ) WITHOUT ROWID
+'''
+
+# Queries are kept as constants so that the same SQL text hits the connection's statement cache on every call
+_SQL_INSERT = '''
+    INSERT OR IGNORE INTO articles (title, url, publication_date, summary, source)
+    VALUES (?, ?, ?, ?, ?)
+'''
+_SQL_UPSERT = '''
+    INSERT INTO articles (title, url, publication_date, summary, source)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(url) DO UPDATE SET
+        title = excluded.title,
+        publication_date = excluded.publication_date,
+        summary = excluded.summary,
+        source = excluded.source
+'''
+# IN (...) lookups are sent in chunks to stay well below SQLite's limit on the number of bound parameters
+_MAX_IN_PARAMS = 500
+_SQL_SELECT_KNOWN_URLS = 'SELECT url FROM articles WHERE url IN ({placeholders})'
+_SQL_SELECT_CACHED_CLASSIFICATIONS = '''
+    SELECT content_hash, is_ai_related
+    FROM classification_cache
+    WHERE content_hash IN ({placeholders})
+'''
+_SQL_SELECT_UNCHECKED = '''
+    SELECT url, title, summary
+    FROM articles
+    WHERE is_ai_related IS NULL
+'''
+_SQL_UPDATE_AI = '''
+    UPDATE articles
+    SET is_ai_related = ?, ai_checked_at = CURRENT_TIMESTAMP
+    WHERE url = ? AND is_ai_related IS NULL
+'''
+_SQL_INSERT_CLASSIFICATION = '''
+    INSERT OR IGNORE INTO classification_cache (content_hash, is_ai_related)
+    VALUES (?, ?)
+'''
+# {columns} is filled in from AI_ARTICLE_COLUMNS (or the caller's column selection)
+_SQL_SELECT_AI = '''
+    SELECT {columns}
+    FROM articles
+    WHERE is_ai_related = 1
+    ORDER BY publication_date DESC, added_at DESC
+    LIMIT ? OFFSET ?
+'''
+_SQL_SELECT_AI_BY_DATE = '''
+    SELECT {columns}
+    FROM articles
+    WHERE is_ai_related = 1 AND publication_date = ?
+    ORDER BY publication_date DESC, added_at DESC
+    LIMIT ? OFFSET ?
+'''
+_SQL_COUNT_AI = '''
+    SELECT COUNT(*) FROM articles
+    WHERE is_ai_related = 1
+'''
+_SQL_COUNT_AI_BY_DATE = '''
+    SELECT COUNT(*) FROM articles
+    WHERE is_ai_related = 1 AND publication_date = ?
+'''
+
+def _migrate_articles_to_url_key(cursor):
+    """
+    One-shot migration from the old schema (INTEGER id primary key plus a UNIQUE url) to the
+    WITHOUT ROWID table keyed on url, which keeps one B-tree per table instead of three.
+    """
+    cursor.execute("PRAGMA table_info(articles)")
+    columns = {row[1] for row in cursor.fetchall()}
+    if 'id' not in columns:
+        return # New database, or already migrated
+
+    logging.info("Migrating articles table to the url-keyed schema...")
+    cursor.execute("BEGIN") # All or nothing: on error the old table is left untouched
+    cursor.execute("ALTER TABLE articles RENAME TO articles_old")
+    cursor.execute(ARTICLES_TABLE_SQL)
+    cursor.execute('''
+        INSERT OR IGNORE INTO articles (url, title, publication_date, summary, source, added_at, is_ai_related, ai_checked_at)
+        SELECT url, title, publication_date, summary, source, added_at, is_ai_related, ai_checked_at
+        FROM articles_old
+    ''')
+    cursor.execute("DROP TABLE articles_old") # Also drops the indexes that were on the old table
+    logging.info("Articles table migration complete.")
+
 def init_db():
     """Initializes the database and creates the articles table if it doesn't exist."""
     try:
-        with sqlite3.connect(DATABASE_NAME) as conn:
+        with _write_conn() as conn:
             cursor = conn.cursor()
+            # WAL lets readers (the Streamlit UI) and the writer (fetching, AI check) work concurrently
+            cursor.execute('PRAGMA journal_mode=WAL')
+            _migrate_articles_to_url_key(cursor)
+            cursor.execute(ARTICLES_TABLE_SQL)
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS articles (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    title TEXT NOT NULL,
-                    url TEXT NOT NULL UNIQUE,
-                    publication_date DATE NOT NULL,
-                    summary TEXT,
-                    source TEXT NOT NULL,
-                    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    is_ai_related BOOLEAN DEFAULT NULL, -- Store AI check result
-                    ai_checked_at TIMESTAMP DEFAULT NULL -- When AI check was performed
+                CREATE TABLE IF NOT EXISTS classification_cache (
+                    content_hash TEXT PRIMARY KEY, -- sha256 of the title and summary
+                    is_ai_related BOOLEAN NOT NULL
                 )
             ''')
+            # Partial indexes matching the hot queries: only unchecked rows, and only AI-related rows by date
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_articles_unchecked
+                ON articles(added_at) WHERE is_ai_related IS NULL
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_ai_by_date
+                ON articles(publication_date DESC, added_at DESC) WHERE is_ai_related = 1
+            ''')
+            cursor.execute('ANALYZE') # Refresh statistics so the query planner picks the indexes
             conn.commit()
             logging.info("Database initialized successfully.")
     except sqlite3.Error as e:
         logging.error(f"Database error during initialization: {e}")
         raise
 
+@lru_cache(maxsize=1024)
+def _parse_str_date(date_str):
+    """Parses a date string, trying ISO format before dateutil. Articles often share dates, so results are cached."""
+    try:
+        return date.fromisoformat(date_str)
+    except ValueError:
+        return parse(date_str).date()
+
 def store_articles(articles, update_existing=False):
     """
     Stores a list of article dictionaries in the database.
-    Uses INSERT OR IGNORE to avoid duplicates based on the UNIQUE URL constraint.
+    Uses INSERT OR IGNORE to avoid duplicates on the url primary key.
+    All articles are written with one batched statement in a single transaction.
     
     Args:
         articles: List of article dictionaries
@@ -44,144 +223,205 @@ def store_articles(articles, update_existing=False):
         logging.info("No articles provided to store.")
         return 0
 
-    inserted_count = 0
-    updated_count = 0
     skipped_count = 0
-    
+    rows = []
+
+    for article in articles:
+        url = article.get('url')
+        title = article.get('title')
+        if not url or not title:
+            # A placeholder URL would collide with the primary key after the first such row
+            logging.warning(f"Article missing url or title ({url!r}, {title!r}). Skipping.")
+            skipped_count += 1
+            continue
+
+        try:
+            # Ensure publication_date is a date object
+            pub_date = article.get('publication_date')
+            if isinstance(pub_date, str):
+                # Attempt to parse if it's a string (should ideally be date obj already)
+                pub_date = _parse_str_date(pub_date)
+            elif not isinstance(pub_date, date):
+                logging.warning(f"Invalid date format for article '{title}': {pub_date}. Skipping.")
+                skipped_count += 1
+                continue
+
+            rows.append((
+                title,
+                url,
+                pub_date,
+                article.get('summary', None), # Use None if summary is missing
+                article.get('source', 'N/A')
+            ))
+        except Exception as e:
+            logging.error(f"Error processing article '{title}': {e}")
+            skipped_count += 1
+
+    if not rows:
+        logging.info(f"Articles processed: {len(articles)}")
+        logging.info(f"- Articles skipped: {skipped_count}")
+        return 0
+
     try:
-        with sqlite3.connect(DATABASE_NAME) as conn:
+        with _write_conn() as conn:
             cursor = conn.cursor()
-            
-            for article in articles:
-                try:
-                    # Ensure publication_date is a date object
-                    pub_date = article.get('publication_date')
-                    if isinstance(pub_date, str):
-                        # Attempt to parse if it's a string (should ideally be date obj already)
-                        from dateutil.parser import parse
-                        pub_date = parse(pub_date).date()
-                    elif not isinstance(pub_date, date):
-                        logging.warning(f"Invalid date format for article '{article.get('title')}': {pub_date}. Skipping.")
-                        skipped_count += 1
-                        continue
-                    
-                    # Check if the URL already exists
-                    cursor.execute('SELECT id FROM articles WHERE url = ?', (article.get('url', 'N/A'),))
-                    existing = cursor.fetchone()
-                    
-                    if existing and update_existing:
-                        # Update the existing article
-                        cursor.execute('''
-                            UPDATE articles 
-                            SET title = ?, publication_date = ?, summary = ?, source = ?
-                            WHERE url = ?
-                        ''', (
-                            article.get('title', 'N/A'),
-                            pub_date,
-                            article.get('summary', None),
-                            article.get('source', 'N/A'),
-                            article.get('url', 'N/A')
-                        ))
-                        if cursor.rowcount > 0:
-                            updated_count += 1
-                            logging.debug(f"Updated existing article: {article.get('title')}")
-                    elif not existing:
-                        # Insert new article
-                        cursor.execute('''
-                            INSERT INTO articles (title, url, publication_date, summary, source)
-                            VALUES (?, ?, ?, ?, ?)
-                        ''', (
-                            article.get('title', 'N/A'),
-                            article.get('url', 'N/A'),
-                            pub_date,
-                            article.get('summary', None), # Use None if summary is missing
-                            article.get('source', 'N/A')
-                        ))
-                        if cursor.rowcount > 0:
-                            inserted_count += 1
-                            logging.debug(f"Inserted new article: {article.get('title')}")
-                    else:
-                        # Article exists but we're not updating
-                        logging.debug(f"Skipped existing article: {article.get('title')}")
-                        skipped_count += 1
-                        
-                except sqlite3.IntegrityError as e:
-                    logging.warning(f"Database integrity error for article '{article.get('title')}': {e}")
-                    skipped_count += 1
-                except Exception as e:
-                    logging.error(f"Error processing article '{article.get('title', 'N/A')}': {e}")
-                    skipped_count += 1
+            if update_existing:
+                # Insert new articles and update existing ones (matched on the url primary key) in one pass
+                cursor.executemany(_SQL_UPSERT, rows)
+            else:
+                # Existing URLs are silently skipped by the url primary key
+                cursor.executemany(_SQL_INSERT, rows)
+            stored_count = cursor.rowcount
+            skipped_count += len(rows) - stored_count
 
             conn.commit()
             logging.info(f"Articles processed: {len(articles)}")
-            logging.info(f"- New articles added: {inserted_count}")
-            logging.info(f"- Existing articles updated: {updated_count}")
+            logging.info(f"- New {'or updated ' if update_existing else ''}articles stored: {stored_count}")
             logging.info(f"- Articles skipped: {skipped_count}")
-            return inserted_count + updated_count
+            return stored_count
     except sqlite3.Error as e:
         logging.error(f"Database error during storing articles: {e}")
         return 0 # Indicate failure or no insertion
 
-def get_articles_for_ai_check():
-    """Fetches articles that haven't been checked by AI yet."""
+def _select_in_chunks(conn, sql_template, values):
+    """Runs an `IN ({placeholders})` query over values, _MAX_IN_PARAMS at a time, yielding every matching row."""
+    cursor = conn.cursor()
+    for start in range(0, len(values), _MAX_IN_PARAMS):
+        chunk = values[start:start + _MAX_IN_PARAMS]
+        cursor.execute(sql_template.format(placeholders=', '.join('?' * len(chunk))), chunk)
+        yield from cursor.fetchall()
+
+def known_urls(urls):
+    """
+    Returns which of the given URLs are already stored, so that scraped articles can be de-duplicated in memory.
+    Only the candidate URLs are looked up (by primary key), never the whole table.
+    """
+    urls = list(urls)
+    known = set()
+    if not urls:
+        return known
+
     try:
-        with sqlite3.connect(DATABASE_NAME) as conn:
+        with _read_conn() as conn:
+            known.update(url for (url,) in _select_in_chunks(conn, _SQL_SELECT_KNOWN_URLS, urls))
+            return known
+    except sqlite3.Error as e:
+        logging.error(f"Database error fetching known URLs: {e}")
+        return set()
+
+def store_new_articles(articles, update_existing=False):
+    """
+    Stores only the articles whose URL isn't in the database yet, then behaves like store_articles.
+    With update_existing every article is passed through, since existing rows must be refreshed.
+    """
+    if articles and not update_existing:
+        known = known_urls(article.get('url') for article in articles if article.get('url'))
+        new_articles = [article for article in articles if article.get('url') not in known]
+        logging.info(f"{len(articles) - len(new_articles)} of {len(articles)} articles are already stored.")
+        if not new_articles:
+            return 0
+        articles = new_articles
+    return store_articles(articles, update_existing)
+
+def iter_articles_for_ai_check():
+    """
+    Yields articles that haven't been checked by AI yet, one dict at a time.
+    The borrowed read connection is held until the generator is exhausted or closed.
+    """
+    try:
+        with _read_conn() as conn:
             cursor = conn.cursor()
-            cursor.execute('''
-                SELECT id, title, summary
-                FROM articles
-                WHERE is_ai_related IS NULL
-            ''')
-            # Fetch as dictionaries
-            desc = cursor.description
-            column_names = [col[0] for col in desc]
-            articles = [dict(zip(column_names, row)) for row in cursor.fetchall()]
-            return articles
+            cursor.row_factory = sqlite3.Row
+            cursor.execute(_SQL_SELECT_UNCHECKED)
+            for row in cursor:
+                yield dict(row)
     except sqlite3.Error as e:
         logging.error(f"Database error fetching articles for AI check: {e}")
-        return []
 
-def update_ai_check_result(article_id, is_ai_related_flag):
-    """Updates the AI check result for a specific article."""
+def get_articles_for_ai_check():
+    """Fetches articles that haven't been checked by AI yet. Prefer iter_articles_for_ai_check to stream them."""
+    return list(iter_articles_for_ai_check())
+
+def update_ai_check_result(url, is_ai_related_flag):
+    """Updates the AI check result for a specific article. Prefer update_ai_check_results for several articles."""
+    return update_ai_check_results([(url, is_ai_related_flag)]) > 0 # Return True if update happened
+
+def update_ai_check_results(results, cache_entries=None):
+    """
+    Updates the AI check results for many articles in a single transaction.
+
+    Args:
+        results: List of (url, is_ai_related_flag) tuples
+        cache_entries: Optional list of (content_hash, is_ai_related_flag) tuples to remember in the
+            classification cache, written in the same transaction
+
+    Returns:
+        The number of articles that were updated.
+    """
+    if not results:
+        return 0
+
     try:
-        with sqlite3.connect(DATABASE_NAME) as conn:
+        with _write_conn() as conn:
             cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE articles
-                SET is_ai_related = ?, ai_checked_at = CURRENT_TIMESTAMP
-                WHERE id = ? AND is_ai_related IS NULL
-            ''', (is_ai_related_flag, article_id))
+            cursor.executemany(_SQL_UPDATE_AI, [(is_ai_related_flag, url) for url, is_ai_related_flag in results])
+            updated_count = cursor.rowcount
+            if cache_entries:
+                cursor.executemany(_SQL_INSERT_CLASSIFICATION, cache_entries)
             conn.commit()
-            logging.debug(f"Updated AI check result for article ID {article_id} to {is_ai_related_flag}")
-            return cursor.rowcount > 0 # Return True if update happened
+            logging.debug(f"Updated AI check results for {updated_count} of {len(results)} articles")
+            return updated_count
+    except sqlite3.Error as e:
+        logging.error(f"Database error updating AI check results for {len(results)} articles: {e}")
+        return 0
+
+def get_cached_classifications(content_hashes):
+    """
+    Looks up previous AI check results for article contents.
+
+    Args:
+        content_hashes: Iterable of content hashes (see ai_filter.content_hash)
+
+    Returns:
+        A dictionary mapping each known content hash to its is_ai_related flag.
+    """
+    content_hashes = list(content_hashes)
+    cached = {}
+    if not content_hashes:
+        return cached
+
+    try:
+        with _read_conn() as conn:
+            rows = _select_in_chunks(conn, _SQL_SELECT_CACHED_CLASSIFICATIONS, content_hashes)
+            cached.update((content_hash, bool(flag)) for content_hash, flag in rows)
+            return cached
     except sqlite3.Error as e:
-        logging.error(f"Database error updating AI check for article ID {article_id}: {e}")
-        return False
+        logging.error(f"Database error fetching cached classifications: {e}")
+        return {}
+
+# Columns needed to display and export an article
+AI_ARTICLE_COLUMNS = ('url', 'title', 'publication_date', 'summary', 'source')
 
-def get_ai_articles(target_date=None):
+def get_ai_articles(target_date=None, limit=None, offset=0, columns=AI_ARTICLE_COLUMNS):
     """
     Fetches articles marked as AI-related, optionally filtered by publication date.
+
+    Args:
+        target_date: Only return articles published on this date (all dates if None)
+        limit: Maximum number of articles to return (all if None)
+        offset: Number of articles to skip, for pagination
+        columns: Columns to select, defaults to AI_ARTICLE_COLUMNS
     """
+    column_list = ', '.join(columns)
     try:
-        with sqlite3.connect(DATABASE_NAME) as conn:
-            conn.row_factory = sqlite3.Row # Return rows as dictionary-like objects
+        with _read_conn() as conn:
             cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row # Return rows as dictionary-like objects
+            limit = -1 if limit is None else limit # LIMIT -1 means no limit in SQLite
             if target_date:
-                 query = '''
-                    SELECT id, title, url, publication_date, summary, source
-                    FROM articles
-                    WHERE is_ai_related = 1 AND publication_date = ?
-                    ORDER BY publication_date DESC, added_at DESC
-                '''
-                 cursor.execute(query, (target_date,))
+                 cursor.execute(_SQL_SELECT_AI_BY_DATE.format(columns=column_list), (target_date, limit, offset))
             else:
-                 query = '''
-                    SELECT id, title, url, publication_date, summary, source
-                    FROM articles
-                    WHERE is_ai_related = 1
-                    ORDER BY publication_date DESC, added_at DESC
-                '''
-                 cursor.execute(query)
+                 cursor.execute(_SQL_SELECT_AI.format(columns=column_list), (limit, offset))
 
             articles = [dict(row) for row in cursor.fetchall()]
             return articles
@@ -189,6 +429,20 @@ def get_ai_articles(target_date=None):
         logging.error(f"Database error fetching AI articles: {e}")
         return []
 
+def count_ai_articles(target_date=None):
+    """Counts articles marked as AI-related, optionally filtered by publication date."""
+    try:
+        with _read_conn() as conn:
+            cursor = conn.cursor()
+            if target_date:
+                cursor.execute(_SQL_COUNT_AI_BY_DATE, (target_date,))
+            else:
+                cursor.execute(_SQL_COUNT_AI)
+            return cursor.fetchone()[0]
+    except sqlite3.Error as e:
+        logging.error(f"Database error counting AI articles: {e}")
+        return 0
+
 if __name__ == '__main__':
     # Example usage: Initialize DB when script is run directly
     logging.info("Initializing database...")
@@ -1,10 +1,14 @@
 # scraper.py
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, Comment, NavigableString
 import logging
+import re
 from datetime import datetime, timedelta, date
 from dateutil.parser import parse, ParserError
-import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -13,6 +17,46 @@ DEFAULT_BBC_URL = "https://www.bbc.com/innovation"
 BASE_BBC_URL = "https://www.bbc.com"
 SOURCE_NAME = "BBC News"
 
+# CSS selectors for the parts of an article card. Substring matches ('*=') replace per-attribute
+# Python callbacks, and soupsieve compiles each selector once and caches it.
+CARD_SELECTOR = 'div[data-indexcard="true"]'
+LINK_SELECTOR = 'a[href]'
+HEADLINE_SELECTOR = 'h1[data-testid*="headline"], h2[data-testid*="headline"], h3[data-testid*="headline"]'
+FALLBACK_HEADLINE_SELECTOR = 'h1, h2, h3'
+DESCRIPTION_SELECTOR = 'p[data-testid*="description"]'
+DATE_SELECTOR = 'span[data-testid="card-metadata-lastupdated"]'
+
+# Relative dates shown on BBC cards, e.g. '5 mins ago', '3 hrs ago', '1 day ago'. Searched rather than
+# matched, so surrounding text like 'Updated 3 hrs ago' or '2 days ago | Tech' still counts as relative
+RELATIVE_DATE_RE = re.compile(r'\b(\d+)\s*(mins?|hrs?|days?)\s+ago\b', re.IGNORECASE)
+
+# Absolute date formats used on BBC cards (e.g. '15 Apr 2025'), tried before the much slower fuzzy parser
+ABSOLUTE_DATE_FORMATS = ("%d %b %Y", "%d %B %Y", "%Y-%m-%d")
+
+# Absolute links are only kept for these hosts (and their subdomains); anything else is a signup, ad, etc.
+BBC_HOSTS = ('bbc.com', 'bbc.co.uk')
+BBC_HOST_SUFFIXES = tuple('.' + host for host in BBC_HOSTS)
+
+FETCH_WORKERS = 8 # Sections fetched concurrently by fetch_articles_many
+
+# Shared session so repeated and concurrent fetches reuse pooled (keep-alive) connections instead of
+# setting up a new TCP/TLS connection per request
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(pool_connections=8, pool_maxsize=16))
+_SESSION.mount('http://', HTTPAdapter(pool_connections=8, pool_maxsize=16))
+_SESSION.headers.update({
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+})
+
+def _txt(tag):
+    """Returns the stripped text of a tag (None if there is no tag), reading a lone text node directly."""
+    if tag is None:
+        return None
+    string = tag.string
+    if isinstance(string, NavigableString) and not isinstance(string, Comment): # A comment isn't visible text
+        return string.strip()
+    return tag.get_text().strip()
+
 # --- Update function definition to accept custom URL ---
 def fetch_articles(news_url=DEFAULT_BBC_URL, source_name=None):
     """Fetches and parses articles from the provided BBC URL."""
@@ -28,39 +72,44 @@ def fetch_articles(news_url=DEFAULT_BBC_URL, source_name=None):
             source_name = "BBC News"
     
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
         logging.info(f"Fetching articles from URL: {news_url}")
-        response = requests.get(news_url, headers=headers, timeout=20)
-        response.raise_for_status() # Raise an exception for bad status codes (4xx or 5xx)
-        time.sleep(1)
-
-        soup = BeautifulSoup(response.content, 'html.parser')
+        # Stream the body straight into the parser instead of keeping a copy in response.content;
+        # a bad status is raised before any of the body is downloaded
+        with _SESSION.get(news_url, timeout=20, stream=True) as response:
+            response.raise_for_status() # Raise an exception for bad status codes (4xx or 5xx)
+            response.raw.decode_content = True # Let urllib3 undo gzip/deflate while reading
+            soup = BeautifulSoup(response.raw, 'lxml') # C-backed parser, much faster than 'html.parser'
 
         # --- Identify article containers ---
         # Let's find common card wrappers first. Look for divs with data-indexcard="true"
-        potential_cards = soup.find_all('div', attrs={'data-indexcard': 'true'})
+        potential_cards = soup.select(CARD_SELECTOR)
         logging.info(f"Found {len(potential_cards)} potential article cards.")
 
         processed_urls = set() # Keep track of URLs to avoid duplicates from different cards pointing to same article
+        now = datetime.now() # One reference time for every card, so 'today' can't shift mid-page
 
         for card in potential_cards:
             article_data = {}
 
             # Find the link (usually the main wrapper is an 'a' tag or contains one)
-            link_tag = card.find('a', href=True)
+            link_tag = card.select_one(LINK_SELECTOR)
             if not link_tag or not link_tag['href']:
                  logging.debug("Skipping card, no valid link found.")
                  continue
 
             url = link_tag['href']
+            try:
+                split_url = urlsplit(url) # Parse once, then classify on its parts
+            except ValueError:
+                 logging.debug(f"Skipping malformed link: {url}")
+                 continue # e.g. an unbalanced IPv6 bracket in the host
             # Handle relative URLs
-            if url.startswith('/'):
+            if not split_url.netloc and url.startswith('/'):
                 full_url = BASE_BBC_URL + url
-            elif url.startswith('http'):
+            elif split_url.scheme in ('http', 'https'):
                  # Check if it's a BBC link or external (like newsletter signup)
-                 if 'bbc.com' in url or 'bbc.co.uk' in url:
+                 host = split_url.hostname or ''
+                 if host in BBC_HOSTS or host.endswith(BBC_HOST_SUFFIXES):
                      full_url = url
                  else:
                      logging.debug(f"Skipping non-BBC link: {url}")
@@ -78,27 +127,27 @@ def fetch_articles(news_url=DEFAULT_BBC_URL, source_name=None):
 
 
             # Find the headline (usually h2 or h3 within the link)
-            headline_tag = link_tag.find(['h1', 'h2', 'h3'], attrs={'data-testid': lambda x: x and 'headline' in x})
+            headline_tag = link_tag.select_one(HEADLINE_SELECTOR)
             if not headline_tag:
-                 headline_tag = link_tag.find(['h1', 'h2', 'h3']) # Fallback
+                 headline_tag = link_tag.select_one(FALLBACK_HEADLINE_SELECTOR) # Fallback
 
-            article_data['title'] = headline_tag.get_text(strip=True) if headline_tag else 'N/A'
+            article_data['title'] = _txt(headline_tag) or 'N/A'
 
             # Find the description/summary (usually a 'p' tag near the headline)
             # Search within the card, not just the link_tag
-            description_tag = card.find('p', attrs={'data-testid': lambda x: x and 'description' in x})
+            description_tag = card.select_one(DESCRIPTION_SELECTOR)
             if not description_tag: # Fallback search if specific testid not found
-                description_tag = card.find('p') # Might be less specific
+                description_tag = card.select_one('p') # Might be less specific
 
-            article_data['summary'] = description_tag.get_text(strip=True) if description_tag else None
+            article_data['summary'] = _txt(description_tag)
 
              # Find the publication date/time
             # This is often in a span with testid 'card-metadata-lastupdated' within the card
-            date_tag = card.find('span', attrs={'data-testid': 'card-metadata-lastupdated'})
-            pub_date_str = date_tag.get_text(strip=True) if date_tag else None
+            date_tag = card.select_one(DATE_SELECTOR)
+            pub_date_str = _txt(date_tag)
 
             if pub_date_str:
-                article_data['publication_date'] = parse_relative_date(pub_date_str)
+                article_data['publication_date'] = parse_relative_date(pub_date_str, now=now)
             else:
                 # Fallback: Look for time tags or other patterns if needed
                 logging.debug(f"No publication date found for {article_data.get('title')}")
@@ -125,9 +174,67 @@ def fetch_articles(news_url=DEFAULT_BBC_URL, source_name=None):
 # --- End of fetch_articles definition ---
 
 
+def fetch_articles_many(sections, max_workers=FETCH_WORKERS):
+    """
+    Fetches several BBC sections concurrently on a thread pool sharing the same session.
+
+    Args:
+        sections: Dictionary mapping source names to section URLs
+        max_workers: Maximum number of sections fetched at the same time
+
+    Returns:
+        A dictionary mapping each source name to its articles (None if fetching that section failed).
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            name: executor.submit(fetch_articles, url, name)
+            for name, url in sections.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+
+def fetch_all_sections(sections):
+    """
+    Fetches several BBC sections concurrently and merges their articles.
+
+    Args:
+        sections: Dictionary mapping source names to section URLs
+
+    Returns:
+        A list of the articles from every section that could be fetched, without duplicate URLs.
+    """
+    results = fetch_articles_many(sections)
+
+    all_articles = []
+    seen_urls = set() # The same article is often listed in several sections
+    for name, articles in results.items():
+        if articles is None:
+            logging.warning(f"Fetching section '{name}' failed. Skipping it.")
+            continue
+        for article in articles:
+            if article['url'] not in seen_urls:
+                seen_urls.add(article['url'])
+                all_articles.append(article)
+
+    logging.info(f"Fetched {len(all_articles)} unique articles from {len(sections)} sections.")
+    return all_articles
+
+
+def group_articles_by_date(articles):
+    """Indexes articles by publication date in a single pass, for repeated lookups by date."""
+    index = defaultdict(list)
+    for article in articles or []:
+        index[article.get('publication_date')].append(article)
+    return index
+
+
 # --- Ensure this function definition is correct ---
-def filter_articles_by_date(articles, target_date):
-    """Filters a list of articles to include only those published on the target_date."""
+def filter_articles_by_date(articles, target_date, index=None):
+    """
+    Filters a list of articles to include only those published on the target_date.
+    Pass an index from group_articles_by_date() to filter the same articles for several dates
+    without rescanning the list each time.
+    """
     if articles is None: # Handle case where fetch_articles failed
         logging.warning("Cannot filter articles because the input list is None.")
         return []
@@ -135,40 +242,52 @@ def filter_articles_by_date(articles, target_date):
         logging.error("Target date must be a date object.")
         return []
 
-    filtered = [
-        article for article in articles
-        if article.get('publication_date') == target_date
-    ]
+    if index is None:
+        # A single lookup: one pass over the list is cheaper than building an index for every date
+        filtered = [
+            article for article in articles
+            if article.get('publication_date') == target_date
+        ]
+    else:
+        filtered = list(index.get(target_date, []))
     logging.info(f"Filtered {len(articles)} articles down to {len(filtered)} for date {target_date}.")
     return filtered
 # --- End of filter_articles_by_date definition ---
 
 
 # --- Ensure this function definition is correct ---
-def parse_relative_date(date_str):
-    """Parses relative date strings like 'X hrs ago', 'X days ago', 'yesterday'."""
-    now = datetime.now()
-    date_str_lower = date_str.lower()
+def parse_relative_date(date_str, now=None):
+    """Parses relative date strings like 'X hrs ago', 'X days ago', 'yesterday'.
+
+    `now` is the reference time for relative dates (defaults to the current time).
+    """
+    now = now or datetime.now()
 
     try:
-        if 'yesterday' in date_str_lower:
+        relative_match = RELATIVE_DATE_RE.search(date_str)
+        if relative_match:
+            amount = int(relative_match.group(1))
+            unit = relative_match.group(2)[0].lower() # 'm'inutes, 'h'ours or 'd'ays
+            if unit == 'h':
+                # Treat articles published less than 24 hours ago but on the same calendar day as today
+                pub_time = now - timedelta(hours=amount)
+                return pub_time.date()
+                # return (now - timedelta(hours=hours)).date() # Original: might put recent articles on yesterday
+            elif unit == 'd':
+                # Ensure minimum 1 day ago if specified
+                return (now - timedelta(days=max(amount, 1))).date()
+            else:
+                # Treat minutes ago as today
+                return now.date()
+        elif 'yesterday' in date_str.lower():
             return (now - timedelta(days=1)).date()
-        elif 'hr ago' in date_str_lower or 'hrs ago' in date_str_lower:
-            hours = int(date_str_lower.split()[0])
-            # Treat articles published less than 24 hours ago but on the same calendar day as today
-            pub_time = now - timedelta(hours=hours)
-            return pub_time.date()
-            # return (now - timedelta(hours=hours)).date() # Original: might put recent articles on yesterday
-        elif 'day ago' in date_str_lower or 'days ago' in date_str_lower:
-            days = int(date_str_lower.split()[0])
-            # Ensure minimum 1 day ago if specified
-            if days == 0: days = 1
-            return (now - timedelta(days=days)).date()
-        elif 'min ago' in date_str_lower or 'mins ago' in date_str_lower:
-             # Treat minutes ago as today
-             return now.date()
         else:
             # Try parsing absolute dates like '15 Apr 2025' or '27 Mar 2025' etc.
+             for date_format in ABSOLUTE_DATE_FORMATS:
+                 try:
+                     return datetime.strptime(date_str.strip(), date_format).date()
+                 except ValueError:
+                     continue
             # Allow fuzzy parsing for different month formats etc.
              return parse(date_str, fuzzy=True).date()
     except (ValueError, IndexError, ParserError, OverflowError) as e: # Added OverflowError